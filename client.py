@@ -13,6 +13,48 @@ TCP_SERVER_ADDRESS = "127.0.0.1"
 TCP_SERVER_PORT = 9000
 UDP_SERVER_ADDRESS = "127.0.0.1"
 UDP_SERVER_PORT = 9001
+# UDPソケットの送受信バッファサイズ(OSの上限で切り詰められる場合がある)
+UDP_SOCKET_BUFFER_SIZE = 8 * 1024 * 1024
+# UDPの受信用バッファのサイズ
+UDP_RECV_BUFFER_SIZE = 65536
+
+# サーバーとのTCP制御用コネクション(リクエストごとに接続し直さず使い回す)
+_tcp_sock = None
+
+def _get_tcp_connection() -> socket.socket:
+  """
+  TCP制御用コネクションを返します。未接続の場合は接続し、TCP_NODELAYを設定します。
+  """
+  global _tcp_sock
+  if _tcp_sock is None:
+    tcp_sock = socket.create_connection((TCP_SERVER_ADDRESS, TCP_SERVER_PORT))
+    # 小さなTCRPメッセージがNagleアルゴリズムで遅延しないようにする
+    tcp_sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    _tcp_sock = tcp_sock
+  return _tcp_sock
+
+def close_tcp_connection():
+  """
+  TCP制御用コネクションを閉じます。
+  """
+  global _tcp_sock
+  if _tcp_sock is not None:
+    _tcp_sock.close()
+    _tcp_sock = None
+
+def _recv_exact(sock: socket.socket, size: int) -> bytearray:
+  """
+  ソケットからちょうどsizeバイトを受信して返します。
+  """
+  buf = bytearray(size)
+  mv = memoryview(buf)
+  received = 0
+  while received < size:
+    nbytes = sock.recv_into(mv[received:])
+    if nbytes == 0:
+      raise ConnectionError("Connection closed by server")
+    received += nbytes
+  return buf
 
 def tcp_client_request(room_name: str, operation: str, username: str, udp_port: int = None) -> str:
   """
@@ -20,48 +62,50 @@ def tcp_client_request(room_name: str, operation: str, username: str, udp_port:
   サーバーから返ってくるトークンを取得する関数。
   """
   try:
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as tcp_sock:
-      tcp_sock.connect((TCP_SERVER_ADDRESS, TCP_SERVER_PORT))
-      state = 0
-      
-      operation = int(operation)
-      if operation == 1:
-        if udp_port is None:
-          logging.error("UDP port is required for creating a chat room")
-          sys.exit(1)
-        payload_str = f"{username},{udp_port}"
-      else:
-        payload_str = username
-      
-      op_payload = payload_str.encode("utf-8")
-      request_message = protocol.encode_tcp_message(room_name, operation, state, op_payload)
-      tcp_sock.sendall(request_message)
-      logging.info(f"TCP request sent: {room_name} {operation} {username}")
-      
-      response_data = tcp_sock.recv(4096)
-      if not response_data:
-        logging.error(f"No response received from server.")
+    tcp_sock = _get_tcp_connection()
+    state = 0
+    
+    operation = int(operation)
+    if operation == 1:
+      if udp_port is None:
+        logging.error("UDP port is required for creating a chat room")
         sys.exit(1)
-      response = protocol.decode_tcp_message(response_data)
-      token = response.get("op_payload").decode("utf-8")
-      logging.info(f"Received token: {token}")
-      return token
+      payload_str = f"{username},{udp_port}"
+    else:
+      payload_str = username
+    
+    op_payload = payload_str.encode("utf-8")
+    request_message = protocol.encode_tcp_message(room_name, operation, state, op_payload)
+    tcp_sock.sendall(request_message)
+    logging.info(f"TCP request sent: {room_name} {operation} {username}")
+    
+    # ヘッダーからボディ長を求めて、応答メッセージ1件分だけを受信する
+    header = _recv_exact(tcp_sock, protocol.TCP_HEADER_SIZE)
+    room_name_size, _, _, op_payload_size = protocol.decode_tcp_header(header)
+    body = _recv_exact(tcp_sock, room_name_size + op_payload_size)
+    response = protocol.decode_tcp_message(header + body)
+    token = str(response.op_payload, "utf-8")
+    logging.info(f"Received token: {token}")
+    return token
   except Exception as e:
     logging.exception(f"TCP client error: {e}")
+    close_tcp_connection()
     sys.exit(1)
 
 def udp_receive_loop(udp_sock: socket.socket):
   """
   UDPソケットでの受信ループです。
   サーバーから送られてくるチャットメッセージを受信し、デコードして表示します。
+  受信バッファは使い回し、recvfrom_intoで直接受信することでパケットごとの確保を避けます。
   """
+  buf = bytearray(UDP_RECV_BUFFER_SIZE)
+  mv = memoryview(buf)
   while True:
     try:
-      data, addr = udp_sock.recv(4096)
-      message_info = protocol.decode_udp_message(data)
-      room_name = message_info.get("room_name")
-      chat_message = message_info.get("message")
-      logging.info(f"Received message from {room_name}: {chat_message}")
+      nbytes, addr = udp_sock.recvfrom_into(buf)
+      # サーバーはメッセージ本文(UTF-8)のみをリレーしてくるので、そのままデコードする
+      chat_message = str(mv[:nbytes], "utf-8", "replace")
+      logging.info("Received message from %s: %s", addr, chat_message)
     except Exception as e:
       logging.exception("UDP server error")
       break
@@ -74,7 +118,7 @@ def udp_send_message(udp_sock: socket.socket, room_name: str, token: str, messag
     udp_message = protocol.encode_udp_message(room_name, token, message)
     udp_sock.sendto(udp_message, (UDP_SERVER_ADDRESS, UDP_SERVER_PORT))
   except Exception as e:
-    logging.exception(f"UDP send error: {e}")
+    logging.exception("UDP send error: %s", e)
     
       
 def main():
@@ -96,6 +140,12 @@ def main():
   
   udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
   with udp_sock:
+    udp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, UDP_SOCKET_BUFFER_SIZE)
+    udp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, UDP_SOCKET_BUFFER_SIZE)
+    logging.info(
+      f"UDP socket buffers: SO_RCVBUF={udp_sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)}, "
+      f"SO_SNDBUF={udp_sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF)} (requested {UDP_SOCKET_BUFFER_SIZE})"
+    )
     # ローカルマシン上の全てのネットワークインターフェースにバインド(ホストに空文字を指定)
     # OSで自動的に利用可能なポートを割り当てる(ポートに0を指定)
     udp_sock.bind(("", 0))
@@ -106,6 +156,8 @@ def main():
       token = tcp_client_request(room_name, operation, username, local_udp_port)
     else:
       token = tcp_client_request(room_name, operation, username)
+    # トークン取得後はTCPを使わないので、サーバー側のワーカーを占有しないように閉じる
+    close_tcp_connection()
       
     udp_thread = threading.Thread(target=udp_receive_loop, args=(udp_sock,), daemon=True)
     udp_thread.start()
@@ -0,0 +1,69 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+"""
+common.protocol のUDPエンコード/デコード処理のCython実装です。
+ビルド済みの場合は common.protocol が自動的にこちらを使い、
+ビルドされていない場合は純Python版がそのまま使われます。
+
+ビルド方法:
+  cythonize -i common/_protocol_fast.pyx
+"""
+
+from cpython.bytes cimport PyBytes_AS_STRING, PyBytes_FromStringAndSize
+from libc.string cimport memcpy
+
+# 上限などの定数は純Python版と共有する
+from common.protocol import UDP_FIELD_MAX as _UDP_FIELD_MAX, UDP_HEADER_SIZE as _UDP_HEADER_SIZE
+
+cdef Py_ssize_t UDP_HEADER_SIZE = _UDP_HEADER_SIZE
+cdef Py_ssize_t UDP_FIELD_MAX = _UDP_FIELD_MAX
+
+
+def encode_udp_message(str room_name, str token, str message):
+  """
+  UDPメッセージをエンコードする。
+  出力のbytesを一度だけ確保し、ヘッダーとボディをmemcpyで直接書き込む。
+  """
+  cdef bytes room_name_bytes = room_name.encode("utf-8")
+  cdef bytes token_bytes = token.encode("utf-8")
+  cdef bytes message_bytes = message.encode("utf-8")
+  cdef Py_ssize_t room_name_size = len(room_name_bytes)
+  cdef Py_ssize_t token_size = len(token_bytes)
+  cdef Py_ssize_t message_size = len(message_bytes)
+
+  if room_name_size > UDP_FIELD_MAX:
+    raise ValueError(f"Room name exceeds maximum length of {UDP_FIELD_MAX} bytes.")
+  if token_size > UDP_FIELD_MAX:
+    raise ValueError(f"Token exceeds maximum length of {UDP_FIELD_MAX} bytes.")
+
+  cdef bytes out = PyBytes_FromStringAndSize(NULL, UDP_HEADER_SIZE + room_name_size + token_size + message_size)
+  cdef char* p = PyBytes_AS_STRING(out)
+  p[0] = <char>room_name_size
+  p[1] = <char>token_size
+  p += UDP_HEADER_SIZE
+  memcpy(p, PyBytes_AS_STRING(room_name_bytes), room_name_size)
+  p += room_name_size
+  memcpy(p, PyBytes_AS_STRING(token_bytes), token_size)
+  p += token_size
+  memcpy(p, PyBytes_AS_STRING(message_bytes), message_size)
+  return out
+
+
+def decode_udp_header(data):
+  """
+  UDPメッセージのヘッダーを解析し、ルーム名・トークン・メッセージの各部分を
+  デコードせずにmemoryviewのスライスとして返す。
+  返り値はdataを参照するため、dataを書き換えると内容も変わる点に注意。
+  """
+  cdef const unsigned char[::1] view = data
+  cdef Py_ssize_t length = view.shape[0]
+  if length < UDP_HEADER_SIZE:
+    raise ValueError(f"Data too short to contain UDP header")
+  cdef Py_ssize_t room_name_size = view[0]
+  cdef Py_ssize_t token_size = view[1]
+  cdef Py_ssize_t token_offset = UDP_HEADER_SIZE + room_name_size
+  cdef Py_ssize_t message_offset = token_offset + token_size
+  if length < message_offset:
+    raise ValueError(f"Data too short for expected room name and token")
+
+  mv = memoryview(data)
+  return mv[UDP_HEADER_SIZE:token_offset], mv[token_offset:message_offset], mv[message_offset:]
@@ -5,13 +5,16 @@
 - パケットはヘッダーとボディから構成される
 - ヘッダー(32バイト)の構成
   Byte 0: RoomNameSize (1バイト)
-    - ボディ内の最初の何バイトがルーム名かを示す。最大2^8バイト。
+    - ボディ内の最初の何バイトがルーム名かを示す。最大2^8-1(255)バイト。
   Byte 1: Operation (1バイト)
     - 操作コード (例: 新規作成=1, 参加=2 など)
   Byte 2: State (1バイト)
     - 状態コード(例: 初期化=0, 応答=1, 完了=2)
-  Byte 3~31: OperationPayloadSize (29バイト)
-    - ボディ内に含まれる Operation Payload のバイト数を29桁の0埋め10新数字として表す。
+  Byte 3~6: OperationPayloadSize (4バイト)
+    - ボディ内に含まれる Operation Payload のバイト数をビッグエンディアンの符号なし整数として表す。
+  Byte 7: ProtocolVersion (1バイト)
+    - ヘッダー形式のバージョン(現在は2)。旧形式(29桁の10進数字)のパケットはここで判別できる。
+  Byte 8~31: 予約 (24バイト、0埋め)
     
   - ボディの構成
     - 最初のRoomNameSizeバイト: ルーム名(UTF-8エンコード)
@@ -28,13 +31,36 @@
   - 残り: 実際のメッセージ(UTF-8エンコード)
 """
 
+import struct
+from dataclasses import dataclass
+
 TCP_HEADER_SIZE = 32
-TCP_ROOMNAME_SIZE = 2 ** 8
+# RoomNameSizeは1バイトのフィールドなので255バイトまで
+TCP_ROOMNAME_SIZE = 2 ** 8 - 1
 TCP_PAYLOAD_MAX = 2 ** 29
-TCP_PAYLOAD_FIELD_WIDTH = 29
+TCP_PROTOCOL_VERSION = 2
 
 UDP_HEADER_SIZE = 2
-UDP_FIELD_MAX = 2 ** 8
+# RoomNameSize/TokenSizeは1バイトのフィールドなので255バイトまで
+UDP_FIELD_MAX = 2 ** 8 - 1
+
+# ヘッダーはモジュール読み込み時に一度だけ組み立てたStructでpack/unpackする
+# RoomNameSize(1) + Operation(1) + State(1) + OperationPayloadSize(4) + ProtocolVersion(1) + 予約(24)
+_TCP_HDR = struct.Struct(">BBBIB24x")
+# RoomNameSize(1) + TokenSize(1)
+_UDP_HDR = struct.Struct(">BB")
+
+@dataclass
+class TCPMessage:
+  """
+  decode_tcp_messageでデコードしたTCPメッセージ。
+  __slots__により属性アクセスを辞書のキー参照より軽くしている。
+  """
+  __slots__ = ("room_name", "operation", "state", "op_payload")
+  room_name: str
+  operation: int
+  state: int
+  op_payload: memoryview
 
 def encode_tcp_message(room_name: str, operation: int, state: int, op_payload: bytes) -> bytes:
   """
@@ -46,63 +72,52 @@ def encode_tcp_message(room_name: str, operation: int, state: int, op_payload: b
     op_payload_bytes = op_payload
     
   room_name_bytes = room_name.encode("utf-8")
-  if len(room_name_bytes) > TCP_ROOMNAME_SIZE:  
-    raise ValueError(f"Room name is too long: {len(room_name_bytes)} bytes (max: {TCP_PAYLOAD_MAX} bytes)")
-  if len(op_payload) > TCP_PAYLOAD_MAX:
-    raise ValueError(f"Operation payload is too long: {len(op_payload)} bytes (max: {TCP_PAYLOAD_MAX} bytes)")
-  
-  # ヘッダーの作成
-  # RoomNameSize
-  room_name_size_byte = len(room_name_bytes).to_bytes(1, "big")
-  # Operation
-  operation_byte = operation.to_bytes(1, "big")
-  # State
-  state_byte = state.to_bytes(1, "big")
-  # OperationPayloadSize: op_payloadの長さを固定幅29桁の0埋め10進数字に変換
-  op_payload_length_str = f"{len(op_payload):0{TCP_PAYLOAD_FIELD_WIDTH}d}"
-  op_payload_size_bytes = op_payload_length_str.encode("utf-8")
-  if len(op_payload_size_bytes) != TCP_PAYLOAD_FIELD_WIDTH:
-    raise ValueError(f"Internal error: Operation payload size field is not {TCP_PAYLOAD_FIELD_WIDTH} bytes")
+  room_name_size = len(room_name_bytes)
+  op_payload_size = len(op_payload_bytes)
+  if room_name_size > TCP_ROOMNAME_SIZE:  
+    raise ValueError(f"Room name is too long: {room_name_size} bytes (max: {TCP_ROOMNAME_SIZE} bytes)")
+  if op_payload_size > TCP_PAYLOAD_MAX:
+    raise ValueError(f"Operation payload is too long: {op_payload_size} bytes (max: {TCP_PAYLOAD_MAX} bytes)")
   
-  header = room_name_size_byte + operation_byte + state_byte + op_payload_size_bytes
-  if len(header) != TCP_HEADER_SIZE:
-    raise ValueError(f"Internal error: TCP header is not {TCP_HEADER_SIZE} bytes")
+  # ヘッダーは事前に組み立てたStructでpackし、ボディとまとめて1回で連結する
+  header = _TCP_HDR.pack(room_name_size, operation, state, op_payload_size, TCP_PROTOCOL_VERSION)
+  return b"".join((header, room_name_bytes, op_payload_bytes))
   
-  # ボディの作成
-  body = room_name_bytes + op_payload_bytes
-  return header + body
-  
-def decode_tcp_message(data: bytes) -> dict:
+def decode_tcp_header(data: bytes) -> tuple:
   """
-  TCPメッセージをデコードする。
+  TCPメッセージのヘッダー(先頭32バイト)をデコードし、
+  (RoomNameSize, Operation, State, OperationPayloadSize)を返す。
+  ストリームから読み込む際に、続くボディのバイト数を知るために使う。
   """
   if len(data) < TCP_HEADER_SIZE:
     raise ValueError(f"Data too short to contain TCP header.")
   
-  room_name_size = data[0]
-  operation = data[1]
-  state = data[2]
-  op_payload_size_field = data[3:TCP_HEADER_SIZE]
-  try:
-    op_payload_size = int(op_payload_size_field.decode("utf-8"))
-  except ValueError:
+  room_name_size, operation, state, op_payload_size, version = _TCP_HDR.unpack_from(data)
+  if version != TCP_PROTOCOL_VERSION:
+    raise ValueError(f"Unsupported TCP protocol version: {version} (expected: {TCP_PROTOCOL_VERSION})")
+  if op_payload_size > TCP_PAYLOAD_MAX:
     raise ValueError(f"Invalid operation payload size field")
+  return room_name_size, operation, state, op_payload_size
+  
+def decode_tcp_message(data: bytes) -> TCPMessage:
+  """
+  TCPメッセージをデコードする。
+  op_payloadはコピーを避けるためdataを参照するmemoryviewとして返す。
+  文字列が必要な場合は呼び出し側で str(op_payload, "utf-8") のようにデコードすること。
+  """
+  room_name_size, operation, state, op_payload_size = decode_tcp_header(data)
   
   expected_body_length = room_name_size + op_payload_size
   if len(data) < TCP_HEADER_SIZE + expected_body_length:
     raise ValueError(f"Data too short for expected body length")
   
-  body = data[TCP_HEADER_SIZE:]
-  room_name_bytes = body[:room_name_size]
-  op_payload = body[room_name_size:room_name_size + op_payload_size]
-  room_name = room_name_bytes.decode("utf-8")
+  mv = memoryview(data)
+  payload_offset = TCP_HEADER_SIZE + room_name_size
+  room_name = str(mv[TCP_HEADER_SIZE:payload_offset], "utf-8")
+  op_payload = mv[payload_offset:payload_offset + op_payload_size]
+  
+  return TCPMessage(room_name, operation, state, op_payload)
   
-  return {
-    "room_name": room_name,
-    "operation": operation,
-    "state": state,
-    "op_payload": op_payload
-  }
 def encode_udp_message(room_name: str, token: str, message: str) -> bytes:
   """
   UDPメッセージをエンコードする。
@@ -110,20 +125,44 @@ def encode_udp_message(room_name: str, token: str, message: str) -> bytes:
   room_name_bytes = room_name.encode("utf-8")
   token_bytes = token.encode("utf-8")
   message_bytes = message.encode("utf-8")
+  room_name_size = len(room_name_bytes)
+  token_size = len(token_bytes)
   
-  if len(room_name_bytes) > UDP_FIELD_MAX:
+  if room_name_size > UDP_FIELD_MAX:
     raise ValueError(f"Room name exceeds maximum length of {UDP_FIELD_MAX} bytes.")
-  if len(token_bytes) > UDP_FIELD_MAX:
+  if token_size > UDP_FIELD_MAX:
     raise ValueError(f"Token exceeds maximum length of {UDP_FIELD_MAX} bytes.")
   
-  header = len(room_name_bytes).to_bytes(1, byteorder="big") + len(token_bytes).to_bytes(1, byteorder="big")
-  body = room_name_bytes + token_bytes + message_bytes
-  return header + body
+  header = _UDP_HDR.pack(room_name_size, token_size)
+  return b"".join((header, room_name_bytes, token_bytes, message_bytes))
+  
+def decode_udp_header(data) -> tuple:
+  """
+  UDPメッセージのヘッダーを解析し、ルーム名・トークン・メッセージの各部分を
+  デコードせずにmemoryviewのスライスとして返す。
+  返り値はdataを参照するため、dataを書き換えると内容も変わる点に注意。
+  """
+  if len(data) < UDP_HEADER_SIZE:
+    raise ValueError(f"Data too short to contain UDP header")
+  room_name_size, token_size = _UDP_HDR.unpack_from(data)
+  if len(data) < UDP_HEADER_SIZE + room_name_size + token_size:
+    raise ValueError(f"Data too short for expected room name and token")
+  
+  mv = memoryview(data)
+  offset = UDP_HEADER_SIZE
+  room_name_bytes = mv[offset:offset+room_name_size]
+  offset += room_name_size
+  token_bytes = mv[offset:offset+token_size]
+  offset += token_size
+  message_mv = mv[offset:]
+  return room_name_bytes, token_bytes, message_mv
   
 def decode_udp_message(data: bytes) -> dict:
   """
   UDPメッセージをデコードする。
   """
+  if isinstance(data, memoryview):
+    data = data.tobytes()
   if len(data) < UDP_HEADER_SIZE:
     raise ValueError(f"Data too short to contain UDP header")
   room_name_size = data[0]
@@ -132,18 +171,20 @@ def decode_udp_message(data: bytes) -> dict:
     raise ValueError(f"Data too short for expected room name and token")
   
   offset = UDP_HEADER_SIZE
-  room_name_bytes = data[offset:offset+room_name_size]
+  room_name = data[offset:offset+room_name_size].decode("utf-8")
   offset += room_name_size
-  token_bytes = data[offset:offset+token_size]
+  token = data[offset:offset+token_size].decode("utf-8")
   offset += token_size
-  message_bytes = data[offset:]
-  
-  room_name = room_name_bytes.decode("utf-8")
-  token = token_bytes.decode("utf-8")
-  message = message_bytes.decode("utf-8")
+  message = data[offset:].decode("utf-8")
   
   return {
     "room_name": room_name,
     "token": token,
     "message": message
   }
+
+# Cython版(common/_protocol_fast.pyx)がビルドされていればそちらを使う
+try:
+  from ._protocol_fast import encode_udp_message, decode_udp_header
+except ImportError:
+  pass
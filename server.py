@@ -1,7 +1,18 @@
+import asyncio
+import collections
+import ctypes
+import errno
+import os
 import socket
+import struct
 import threading
 import logging
+import multiprocessing
+import queue
+import signal
 import uuid
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.managers import SyncManager
 from common import protocol
 
 SERVER_ADDRESS = "0.0.0.0"
@@ -9,21 +20,273 @@ SERVER_ADDRESS = "0.0.0.0"
 TCP_SERVER_PORT = 9000  
 # メッセージ交換用のUDPポート
 UDP_SERVER_PORT = 9001
+# UDPワーカープロセスの起動(bind)完了を待つ秒数
+UDP_WORKER_START_TIMEOUT = 10
+# UDPソケットの送受信バッファサイズ(バースト時のパケットロス対策)
+# OSの上限(Linuxではnet.core.rmem_max/wmem_max)で切り詰められる場合があるので
+# 必要に応じて sysctl -w net.core.rmem_max=12582912 などで引き上げる
+UDP_SOCKET_BUFFER_SIZE = 8 * 1024 * 1024
+# UDPの受信用バッファ1つあたりのサイズ(UDPデータグラムの最大長)
+UDP_RECV_BUFFER_SIZE = 65535
+# recvmmsg(2)で1回のシステムコールで受信するデータグラムの最大数
+UDP_RECV_BATCH_SIZE = 64
+# TCP接続を処理するワーカースレッドの上限
+TCP_MAX_WORKERS = 64
+# 無通信のTCP接続を閉じるまでの秒数(接続を使い回すクライアントがワーカーを占有し続けないようにする)
+TCP_IDLE_TIMEOUT = 30
+# 受け付けるTCRPメッセージ(ヘッダー込み)の最大バイト数
+# 作成・参加の操作は"ユーザー名,ポート"程度しか運ばないので小さく制限し、
+# 未認証のヘッダーだけで巨大なバッファを確保させないようにする
+TCP_MAX_MESSAGE_SIZE = 4096
 
 logging.basicConfig(
   level=logging.INFO,
   format="%(asctime)s - %(levelname)s - %(message)s"
 )
+# UDPのホットパスでログ出力の要否を判定するためのロガー
+_log = logging.getLogger()
+
+
+def _udp_worker_processes() -> int:
+  """
+  環境変数 CHAT_UDP_WORKERS からUDPワーカープロセス数を読み取ります。
+  整数でない値や1未満の値、SO_REUSEPORTが使えない環境での2以上の値は警告を出して1として扱います。
+  """
+  value = os.environ.get("CHAT_UDP_WORKERS") or "1"
+  try:
+    workers = int(value)
+  except ValueError:
+    logging.warning(f"Invalid CHAT_UDP_WORKERS value {value!r}, using 1 UDP worker")
+    return 1
+  if workers < 1:
+    logging.warning(f"CHAT_UDP_WORKERS must be at least 1 (got {workers}), using 1 UDP worker")
+    return 1
+  if workers > 1 and not hasattr(socket, "SO_REUSEPORT"):
+    logging.warning(f"SO_REUSEPORT is not available, using 1 UDP worker instead of {workers}")
+    return 1
+  return workers
+
+
+# UDPを受信するワーカープロセス数(環境変数 CHAT_UDP_WORKERS で指定、既定は1)
+# 2以上の場合はSO_REUSEPORTで同じポートに複数プロセスがbindし、カーネルが送信元ごとに振り分ける
+# 1の場合はプロセスを分けず、TCPと同じプロセス内のスレッドで受信する
+# 送信元ごとの振り分けになるため、少数の送信元からのトラフィックでは効果がない点に注意
+UDP_WORKER_PROCESSES = _udp_worker_processes()
+
+# TCP接続の処理は接続ごとにスレッドを生成せず、上限付きのスレッドプールで実行する
+_POOL = ThreadPoolExecutor(max_workers=TCP_MAX_WORKERS, thread_name_prefix="tcp-worker")
+
+
+# sendmmsg(2)/recvmmsg(2)で1回のシステムコールにまとめて送受信するための構造体定義(Linux)
+class _IOVec(ctypes.Structure):
+  _fields_ = [("iov_base", ctypes.c_void_p), ("iov_len", ctypes.c_size_t)]
+
+
+class _MsgHdr(ctypes.Structure):
+  _fields_ = [
+    ("msg_name", ctypes.c_void_p),
+    ("msg_namelen", ctypes.c_uint32),
+    ("msg_iov", ctypes.POINTER(_IOVec)),
+    ("msg_iovlen", ctypes.c_size_t),
+    ("msg_control", ctypes.c_void_p),
+    ("msg_controllen", ctypes.c_size_t),
+    ("msg_flags", ctypes.c_int),
+  ]
+
+
+class _MMsgHdr(ctypes.Structure):
+  _fields_ = [("msg_hdr", _MsgHdr), ("msg_len", ctypes.c_uint)]
+
+
+try:
+  _libc = ctypes.CDLL("libc.so.6", use_errno=True)
+  _libc_sendmmsg = _libc.sendmmsg
+  _libc_sendmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int]
+  _libc_sendmmsg.restype = ctypes.c_int
+  _libc_recvmmsg = _libc.recvmmsg
+  _libc_recvmmsg.argtypes = [ctypes.c_int, ctypes.c_void_p, ctypes.c_uint, ctypes.c_int, ctypes.c_void_p]
+  _libc_recvmmsg.restype = ctypes.c_int
+except (OSError, AttributeError):
+  # Linux以外(Windows/macOS)ではsendto/recvfrom_intoのループにフォールバックする
+  _libc_sendmmsg = None
+  _libc_recvmmsg = None
+
+# prctl(2)で親プロセスの終了時に受け取るシグナルを設定する操作(Linuxのみ)
+PR_SET_PDEATHSIG = 1
+try:
+  _libc_prctl = ctypes.CDLL("libc.so.6", use_errno=True).prctl
+except (OSError, AttributeError):
+  _libc_prctl = None
+
+
+def _sockaddr_in(ip: str, port: int) -> bytes:
+  """
+  struct sockaddr_in(16バイト)のバイト列を生成します。
+  sin_familyはホストバイトオーダー、ポートとアドレスはネットワークバイトオーダーです。
+  """
+  return struct.pack("=H", socket.AF_INET) + struct.pack("!H", port) + socket.inet_aton(ip) + bytes(8)
+
+
+class _SendBatch:
+  """
+  sendmmsg(2)用のmmsghdr/iovecの配列を事前に確保して使い回します。
+  スレッド間で共有しないよう、スレッドごとに1つずつ生成して使います。
+  """
+  INITIAL_CAPACITY = 16
+  
+  def __init__(self):
+    self.capacity = 0
+    self._grow(self.INITIAL_CAPACITY)
+    
+    
+  def _grow(self, capacity: int):
+    self.vec = (_MMsgHdr * capacity)()
+    self.iovs = (_IOVec * capacity)()
+    for i in range(capacity):
+      hdr = self.vec[i].msg_hdr
+      hdr.msg_iov = ctypes.pointer(self.iovs[i])
+      hdr.msg_iovlen = 1
+    self.capacity = capacity
+    
+    
+  def send(self, sock: socket.socket, msgs):
+    count = len(msgs)
+    if count > self.capacity:
+      self._grow(max(count, self.capacity * 2))
+    
+    # ctypesのオブジェクトはsendmmsgが戻るまで参照を保持しておく
+    keep = []
+    last_data = None
+    for i, (_, sockaddr, data) in enumerate(msgs):
+      # リレーでは全員に同じデータを送るので、ポインタの生成は異なるデータごとに1回だけ行う
+      if data is not last_data:
+        if isinstance(data, bytes):
+          payload = ctypes.c_char_p(data)
+        elif data.readonly:
+          payload = ctypes.c_char_p(bytes(data))
+        else:
+          # 受信バッファ(bytearray)上のmemoryviewはコピーせずにそのまま参照する
+          payload = (ctypes.c_char * len(data)).from_buffer(data)
+        payload_addr = ctypes.cast(payload, ctypes.c_void_p).value
+        last_data = data
+      # sockaddrは参加時に作成済みのbytesをコピーせずに参照する
+      name = ctypes.c_char_p(sockaddr)
+      keep.append((name, payload))
+      self.iovs[i].iov_base = payload_addr
+      self.iovs[i].iov_len = len(data)
+      hdr = self.vec[i].msg_hdr
+      hdr.msg_name = ctypes.cast(name, ctypes.c_void_p)
+      hdr.msg_namelen = len(sockaddr)
+    
+    fd = sock.fileno()
+    sent = 0
+    while sent < count:
+      n = _libc_sendmmsg(fd, ctypes.addressof(self.vec) + sent * ctypes.sizeof(_MMsgHdr), count - sent, 0)
+      if n < 0:
+        err = ctypes.get_errno()
+        raise OSError(err, f"sendmmsg failed: {os.strerror(err)}")
+      sent += n
+
+
+_send_batches = threading.local()
+
+
+def _sendmmsg(sock: socket.socket, msgs):
+  """
+  (addr, sockaddr, data)のリストをまとめて送信します。
+  Linuxではsendmmsg(2)で1回のシステムコールにまとめ、それ以外ではsendtoで1件ずつ送信します。
+  """
+  if not msgs:
+    return
+  if _libc_sendmmsg is None:
+    for addr, _, data in msgs:
+      sock.sendto(data, addr)
+    return
+  
+  batch = getattr(_send_batches, "batch", None)
+  if batch is None:
+    batch = _send_batches.batch = _SendBatch()
+  batch.send(sock, msgs)
+
+
+class _RecvBatch:
+  """
+  recvmmsg(2)用に受信バッファとmmsghdr/iovec/sockaddr_inの配列を事前に確保して使い回します。
+  """
+  SOCKADDR_IN_SIZE = 16
+  
+  def __init__(self, batch_size: int, buffer_size: int):
+    self.batch_size = batch_size
+    self.buffers = [bytearray(buffer_size) for _ in range(batch_size)]
+    self.vec = (_MMsgHdr * batch_size)()
+    self.iovs = (_IOVec * batch_size)()
+    self.names = [ctypes.create_string_buffer(self.SOCKADDR_IN_SIZE) for _ in range(batch_size)]
+    # バッファのアドレスをiovecに固定する(バッファ自体はサイズを変えずに使い回す)
+    self._c_buffers = [(ctypes.c_char * buffer_size).from_buffer(buf) for buf in self.buffers]
+    for i in range(batch_size):
+      self.iovs[i].iov_base = ctypes.addressof(self._c_buffers[i])
+      self.iovs[i].iov_len = buffer_size
+      hdr = self.vec[i].msg_hdr
+      hdr.msg_name = ctypes.addressof(self.names[i])
+      hdr.msg_iov = ctypes.pointer(self.iovs[i])
+      hdr.msg_iovlen = 1
+      
+      
+  def recv(self, sock: socket.socket) -> int:
+    """
+    ソケットから最大batch_size件のデータグラムをノンブロッキングで受信し、受信件数を返します。
+    受信できるデータがない場合は0を返します。
+    """
+    for i in range(self.batch_size):
+      # カーネルが書き換えるため毎回リセットする
+      self.vec[i].msg_hdr.msg_namelen = self.SOCKADDR_IN_SIZE
+      self.vec[i].msg_hdr.msg_flags = 0
+    n = _libc_recvmmsg(sock.fileno(), ctypes.addressof(self.vec), self.batch_size, socket.MSG_DONTWAIT, None)
+    if n < 0:
+      err = ctypes.get_errno()
+      if err in (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINTR):
+        return 0
+      raise OSError(err, f"recvmmsg failed: {os.strerror(err)}")
+    return n
+    
+    
+  def datagram(self, i: int):
+    """
+    i番目に受信したデータグラムの(データのmemoryview, 送信元アドレス)を返します。
+    """
+    name = self.names[i].raw
+    addr = (socket.inet_ntoa(name[4:8]), struct.unpack_from("!H", name, 2)[0])
+    return memoryview(self.buffers[i])[:self.vec[i].msg_len], addr
+
 
 class ChatRoomManager:
   """
   各チャットルームの状態を管理する簡易的なマネージャーです。
   各チャットルームはroom_nameをキーとして保持し、
   ホスト(作成者)と参加者の情報(IP, ユーザー名, 発行済みトークン)を管理します。
+  トークンはUDPで受信したバイト列とそのまま比較できるようにbytesで保持します。
+  chat_roomsにmultiprocessing.Managerの共有辞書を渡すと、複数のUDPワーカープロセスから参照できます。
+  その場合はversionに共有メモリ上のカウンタ(multiprocessing.RawValue)を渡し、
+  書き込みのたびにカウンタを進めます。読み込み側はカウンタが変わったときだけ
+  共有辞書をローカルにコピーし直すため、パケットごとのプロセス間通信は発生しません。
   """
-  def __init__(self):
+  def __init__(self, chat_rooms=None, version=None):
+    # 書き込み(作成・参加・削除)のみをロックで直列化する
+    # ルームの辞書は書き換えずに新しい辞書で置き換える(コピーオンライト)ため、
+    # 読み込み側はロックなしで一貫したスナップショットを参照できる
+    # 共有辞書を使う場合も書き込むのはTCPサーバーのプロセスだけなので、ロックはプロセス内で足りる
     self.lock =  threading.Lock()
-    self.chat_rooms = {}
+    self.chat_rooms = chat_rooms if chat_rooms is not None else {}
+    self.version = version
+    self._local_rooms = {}
+    self._local_version = None
+    
+    
+  def _bump_version(self):
+    # 共有辞書を書き換えた後に呼び、UDPワーカープロセスにローカルコピーの更新を促す
+    # 書き込むのはTCPサーバーのプロセスだけで、self.lockの中で呼ぶため加算は競合しない
+    if self.version is not None:
+      self.version.value += 1
     
     
   def create_chat_room(self, room_name: str, host_ip: str, host_username: str, host_udp_port: int) -> str:
@@ -32,193 +295,459 @@ class ChatRoomManager:
         logging.warning(f"Chat room already exists: {room_name}")
         return None
     
-    token = uuid.uuid4().hex
-    self.chat_rooms[room_name] = {
-      "host": {"ip": host_ip, "username": host_username, "token": token, "port": host_udp_port},
-      "participants": {}
-    }
+      token = uuid.uuid4().hex
+      self.chat_rooms[room_name] = {
+        "host": {
+          "ip": host_ip, "username": host_username, "token": token.encode("ascii"), "port": host_udp_port,
+          "addr": (host_ip, host_udp_port), "sockaddr": _sockaddr_in(host_ip, host_udp_port)
+        },
+        "participants": {}
+      }
+      self._bump_version()
     logging.info(f"Created Chat room {room_name} with host token: {token} and UDP port: {host_udp_port}")
     return token
   
   
   def join_chat_room(self, room_name: str, participant_ip: str, participant_username: str) -> str:
     with self.lock:
-      if room_name not in self.chat_rooms:
+      chat_room = self.chat_rooms.get(room_name)
+      if chat_room is None:
         logging.error(f"Chat room not found: {room_name}")
         return None
       
       token = uuid.uuid4().hex
-      self.chat_rooms[room_name]["participants"][participant_ip] = {
+      participants = dict(chat_room["participants"])
+      participants[participant_ip] = {
         "user_name": participant_username,
-        "token": token
+        "token": token.encode("ascii"),
+        # リレー時に毎回組み立てないように宛先アドレスを参加時に作っておく
+        "addr": (participant_ip, UDP_SERVER_PORT),
+        "sockaddr": _sockaddr_in(participant_ip, UDP_SERVER_PORT)
       }
-      logging.info(f"participant {participant_username} joined chat room {room_name} with token: {token}")
-      return token
+      # リレー中のスレッドが古い参加者一覧を走査していても影響しないように丸ごと置き換える
+      self.chat_rooms[room_name] = {**chat_room, "participants": participants}
+      self._bump_version()
+    logging.info(f"participant {participant_username} joined chat room {room_name} with token: {token}")
+    return token
     
     
   def get_chat_room(self, room_name: str):
-    with self.lock:
+    # CPythonの辞書の読み込みはアトミックなのでロックは取らない
+    if self.version is None:
       return self.chat_rooms.get(room_name)
+    # コピー前にカウンタを読むので、コピー中に書き込みがあっても次回の呼び出しで取り直される
+    version = self.version.value
+    if version != self._local_version:
+      self._local_rooms = self.chat_rooms.copy()
+      self._local_version = version
+    return self._local_rooms.get(room_name)
     
     
   def remove_chat_room(self, room_name: str):
     with self.lock:
       if room_name in self.chat_rooms:
         del self.chat_rooms[room_name]
+        self._bump_version()
         logging.info(f"Removed chat room {room_name}")
       else:
         logging.error(f"Chat room not found: {room_name}")
 
 
+def _handle_tcp_request(data, addr) -> bytes:
+  """
+  受信したTCRPメッセージ1件をデコードし、
+  操作コードに応じてチャットルームの作成または参加を処理して、応答メッセージを返します。
+  """
+  # TCPメッセージのデコード
+  message = protocol.decode_tcp_message(data)
+  room_name = message.room_name
+  operation = message.operation
+  state = message.state
+  op_payload = message.op_payload
+  
+  op_payload_decoded = str(op_payload, "utf-8")
+  parts = op_payload_decoded.split(",")
+  username = parts[0]
+  if len(parts) > 1:
+    try:
+      host_udp_port = int(parts[1])
+    except ValueError:
+      host_udp_port = None
+  else:
+    host_udp_port = None
+  
+  logging.info(f"TCP request from {addr} room name: {room_name}, operation: {operation}, state: {state}, username: {username}, host_udp_port: {host_udp_port}")
+  
+  if operation == 1:
+    if host_udp_port is None:
+      logging.error(f"UDP port not provided by host in creation request")
+      response_payload = "ERROR: UDP port not provided".encode("utf-8")
+    else:
+      token = chat_room_manager.create_chat_room(room_name, addr[0], username, host_udp_port)
+      if token is None:
+        response_payload = "ERROR: chat room is already exist. {room_name}"
+      else:
+        response_payload = token.encode("utf-8")
+  elif operation == 2:
+    # チャットルーム参加要求
+    token = chat_room_manager.join_chat_room(room_name, addr[0], username)
+    if token is None:
+      response_payload = "ERROR: chat room not found. {room_name}"
+    else:
+      response_payload = token.encode("utf-8")
+  else:
+    response_payload = "ERROR: unknown operation".encode("utf-8")
+    
+  # stateは2(完了)に設定してresponseを生成
+  return protocol.encode_tcp_message(room_name, operation, 2, response_payload)
+
+
+# TCP受信バッファ(TCP_MAX_MESSAGE_SIZEバイト)のフリーリスト(接続ごとに1つ取り出し、接続終了時に戻す)
+_tcp_buffer_pool = collections.deque()
+
+
+def _recv_exact_into(conn: socket.socket, mv: memoryview) -> bool:
+  """
+  mvがちょうど埋まるまで受信します。
+  1バイトも受信しないうちに接続が閉じられた場合はFalseを返し、
+  途中で閉じられた場合は例外を送出します。
+  """
+  received = 0
+  while received < len(mv):
+    nbytes = conn.recv_into(mv[received:])
+    if nbytes == 0:
+      if received == 0:
+        return False
+      raise ConnectionError(f"Connection closed after {received} of {len(mv)} bytes")
+    received += nbytes
+  return True
+
+
 def handle_tcp_connection(conn: socket.socket, addr):
   """
   TCP接続ごとに呼び出されるハンドラ。
-  クライアントから受信したTCRPに沿ってメッセージをデコードし、
-  操作コードに応じてチャットルームの作成または参加を処理し、
-  結果としてトークンを返します。
+  クライアントが接続を閉じるまで、受信したTCRPメッセージごとに
+  チャットルームの作成または参加を処理し、結果としてトークンを返します。
+  メッセージはヘッダー(32バイト)からボディ長を求め、1件分をちょうど受信してから処理します。
+  TCP_MAX_MESSAGE_SIZEを超えるメッセージはエラーを返して接続を閉じます。
   """
+  buf = _tcp_buffer_pool.pop() if _tcp_buffer_pool else bytearray(TCP_MAX_MESSAGE_SIZE)
   try:
     with conn:
-      data = conn.recv(4096)
-      if not data:
-        logging.error(f"No data received from TCP connection {addr}")
-        return
-      
-      # TCPメッセージのデコード
-      message = protocol.decode_tcp_message(data)
-      room_name = message.get("room_name")
-      operation = message.get("operation")
-      state = message.get("state")
-      op_payload = message.get("op_payload")
-      
-      op_payload_decoded = op_payload.decode("utf-8")
-      parts = op_payload_decoded.split(",")
-      username = parts[0]
-      if len(parts) > 1:
+      conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+      conn.settimeout(TCP_IDLE_TIMEOUT)
+      while True:
         try:
-          host_udp_port = int(parts[1])
-        except ValueError:
-          host_udp_port = None
-      else:
-        host_udp_port = None
-      
-      logging.info(f"TCP request from {addr} room name: {room_name}, operation: {operation}, state: {state}, username: {username}, host_udp_port: {host_udp_port}")
-      
-      if operation == 1:
-        if host_udp_port is None:
-          logging.error(f"UDP port not provided by host in creation request")
-          response_payload = "ERROR: UDP port not provided".encode("utf-8")
-        else:
-          token = chat_room_manager.create_chat_room(room_name, addr[0], username, host_udp_port)
-          if token is None:
-            response_payload = "ERROR: chat room is already exist. {room_name}"
-          else:
-            response_payload = token.encode("utf-8")
-      elif operation == 2:
-        # チャットルーム参加要求
-        token = chat_room_manager.join_chat_room(room_name, addr[0], username)
-        if token is None:
-          response_payload = "ERROR: chat room not found. {room_name}"
-        else:
-          response_payload = token.encode("utf-8")
-      else:
-        response_payload = "ERROR: unknown operation".encode("utf-8")
+          header = memoryview(buf)[:protocol.TCP_HEADER_SIZE]
+          if not _recv_exact_into(conn, header):
+            logging.info(f"TCP connection closed by {addr}")
+            return
+          room_name_size, operation, _, op_payload_size = protocol.decode_tcp_header(header)
+          
+          message_size = protocol.TCP_HEADER_SIZE + room_name_size + op_payload_size
+          if message_size > TCP_MAX_MESSAGE_SIZE:
+            # ボディを読まずに応答して接続を閉じる(ストリーム上の区切りが分からなくなるため)
+            logging.error(f"TCP message from {addr} too large: {message_size} bytes (max: {TCP_MAX_MESSAGE_SIZE} bytes)")
+            conn.sendall(protocol.encode_tcp_message("", operation, 2, "ERROR: message too large"))
+            return
+          message = memoryview(buf)[:message_size]
+          if not _recv_exact_into(conn, message[protocol.TCP_HEADER_SIZE:]):
+            raise ConnectionError(f"Connection closed before message body")
+        except socket.timeout:
+          logging.info(f"Closing idle TCP connection from {addr}")
+          return
         
-      # stateは2(完了)に設定してresponseを生成
-      response = protocol.encode_tcp_message(room_name, operation, 2, response_payload)
-      conn.sendall(response)
-      logging.info(f"Sent TCP response to {addr}")
+        response = _handle_tcp_request(message, addr)
+        conn.sendall(response)
+        logging.info(f"Sent TCP response to {addr}")
   except Exception as e:
     logging.exception(f"Exception handling TCP connection from {addr}")
+  finally:
+    _tcp_buffer_pool.append(buf)
    
     
-def tcp_server():
+def _make_listener() -> socket.socket:
   """
-  TCPサーバーを起動し、クライアントからの接続を待機します。
-  各接続は、handle_tcp_connectionで処理され、スレッドで並行実行されます。
+  TCPの待ち受けソケットを生成します。
+  SO_REUSEPORTは設定しないため、同じポートで別のサーバーが動いている場合はbindがEADDRINUSEで失敗します。
   """
   tcp_sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+  tcp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
   tcp_sock.bind((SERVER_ADDRESS, TCP_SERVER_PORT))
   tcp_sock.listen(5)
-  logging.info(f"TCP server listening on {SERVER_ADDRESS}: {TCP_SERVER_PORT}")
+  return tcp_sock
+
+
+def _accept_loop(tcp_sock: socket.socket):
   while True:
     conn, addr = tcp_sock.accept()
     logging.info(f"Accepted TCP connection from {addr}")
-    threading.Thread(target=handle_tcp_connection, args=(conn, addr), daemon=True).start()
+    _POOL.submit(handle_tcp_connection, conn, addr)
     
     
-def handle_udp_message(data: bytes, addr, udp_sock: socket.socket):
+def tcp_server():
+  """
+  TCPサーバーを起動し、クライアントからの接続を待機します。
+  待ち受けソケットは1つだけ生成し、CPUコア数分のacceptスレッドで共有します。
+  各接続は、handle_tcp_connectionで処理され、スレッドプールで並行実行されます。
+  """
+  tcp_sock = _make_listener()
+  num_acceptors = os.cpu_count() or 1
+  acceptors = []
+  for _ in range(num_acceptors):
+    acceptor = threading.Thread(target=_accept_loop, args=(tcp_sock,), daemon=True)
+    acceptor.start()
+    acceptors.append(acceptor)
+  logging.info(f"TCP server listening on {SERVER_ADDRESS}: {TCP_SERVER_PORT} with {num_acceptors} accept thread(s)")
+  for acceptor in acceptors:
+    acceptor.join()
+    
+    
+def handle_udp_message(data, addr, udp_sock: socket.socket):
   """
   UDPで受信したメッセージを処理します。
-  メッセージはprotocol.decode_udp_messageによりデコードし、対象チャットルーム内の参加者へリレーします。
-  リレー前にトークンの妥当性をチェックします。
+  メッセージはprotocol.decode_udp_headerで各部分に分割し、対象チャットルーム内の参加者へリレーします。
+  トークンとメッセージはデコードせず、バイト列のままトークン確認とリレーを行います。
   """
   try:
-    message = protocol.decode_udp_message(data)
-    room_name = message.get("room_name")
-    token = message.get("token")
-    chat_text = message.get("message")
-    logging.info(f"UDP message from {addr} in room {room_name} with token {token}")
+    room_name_bytes, token_bytes, message_mv = protocol.decode_udp_header(data)
+    room_name = str(room_name_bytes, "utf-8")
+    # トークンのデコードはログ出力が有効な場合のみ行う
+    if _log.isEnabledFor(logging.INFO):
+      logging.info("UDP message from %s in room %s with token %s", addr, room_name, str(token_bytes, "utf-8"))
     
     chat_room = chat_room_manager.get_chat_room(room_name)
     if not chat_room:
-      logging.error(f"Chat room {room_name} not found for UDP message from {addr}")
+      logging.error("Chat room %s not found for UDP message from %s", room_name, addr)
       return
     
     valid = False
     # ホストの場合のトークン確認
     host_info = chat_room["host"]
-    host_addr = (host_info["ip"], host_info["port"])
-    if host_addr == addr and host_info["token"] == token:
+    if host_info["addr"] == addr and host_info["token"] == token_bytes:
       valid = True
     # 参加者の場合のトークン確認
     else:
       participant = chat_room["participants"].get(addr[0])
-      if participant and participant["token"] == token:
+      if participant and participant["token"] == token_bytes:
         valid = True
       if not valid:
-        logging.error(f"Invalid token from {addr} for chat room {room_name}")
+        logging.error("Invalid token from %s for chat room %s", addr, room_name)
         return
       
     # リレー処理(チャットルームの全ての参加者へ送信、ホスト含む)
-    relay_data = chat_text.encode("utf-8")
-    host_addr = (chat_room["host"]["ip"], chat_room["host"]["port"])
-    if host_addr != addr:
-      udp_sock.sendto(relay_data, host_addr)
-    for part_ip, part_info in chat_room["participants"].items():
-      part_addr = (part_ip, UDP_SERVER_PORT)
-      if part_addr != addr:
-        udp_sock.sendto(relay_data, part_addr)
-    logging.info(f"Relayed UDP message in room {room_name}")
+    # 受信したメッセージ部分をデコード/再エンコードせずにそのまま転送する
+    relay_data = message_mv
+    relay_msgs = []
+    if host_info["addr"] != addr:
+      relay_msgs.append((host_info["addr"], host_info["sockaddr"], relay_data))
+    for part_info in chat_room["participants"].values():
+      if part_info["addr"] != addr:
+        relay_msgs.append((part_info["addr"], part_info["sockaddr"], relay_data))
+    _sendmmsg(udp_sock, relay_msgs)
+    if _log.isEnabledFor(logging.INFO):
+      logging.info("Relayed UDP message in room %s", room_name)
   except Exception as e:
-    logging.exception(f"Exception handling UDP message from {addr}")
+    logging.exception("Exception handling UDP message from %s", addr)
     
        
-def udp_server():
+# 受信バッファのフリーリスト(bytearrayを使い回して受信ごとの確保を避ける)
+_udp_buffer_pool = collections.deque()
+
+
+class _UdpReader:
   """
-  UDPサーバーを起動し、チャットメッセージの受信とリレーを行います。
+  UDPソケットが読み込み可能になったらイベントループ上で受信とリレーを行います。
+  パケットごとにスレッドを生成せず、handle_udp_messageを同期的に呼び出します。
+  Linuxではrecvmmsgで複数のデータグラムをまとめて受信し、
+  それ以外ではプールから取り出したバッファへのrecvfrom_intoで1件ずつ受信します。
+  受信データがない間はイベントループ(select/epoll)で待機します。
   """
+  def __init__(self, udp_sock: socket.socket):
+    self.udp_sock = udp_sock
+    self.batch = _RecvBatch(UDP_RECV_BATCH_SIZE, UDP_RECV_BUFFER_SIZE) if _libc_recvmmsg is not None else None
+    
+    
+  def on_readable(self):
+    if self.batch is not None:
+      self._receive_batch()
+    else:
+      self._receive_each()
+      
+      
+  def _receive_batch(self):
+    # バッチが埋まる間は続けて受信し、キューを空にする
+    while True:
+      try:
+        n = self.batch.recv(self.udp_sock)
+      except OSError as e:
+        logging.error("UDP server error: %s", e)
+        return
+      for i in range(n):
+        data, addr = self.batch.datagram(i)
+        handle_udp_message(data, addr, self.udp_sock)
+      if n < self.batch.batch_size:
+        return
+        
+        
+  def _receive_each(self):
+    # 読み込み可能になった時点でキューにあるデータグラムをまとめて処理する
+    while True:
+      buf = _udp_buffer_pool.pop() if _udp_buffer_pool else bytearray(UDP_RECV_BUFFER_SIZE)
+      try:
+        nbytes, addr = self.udp_sock.recvfrom_into(buf)
+      except (BlockingIOError, InterruptedError):
+        _udp_buffer_pool.append(buf)
+        return
+      except OSError as e:
+        _udp_buffer_pool.append(buf)
+        logging.error("UDP server error: %s", e)
+        return
+      try:
+        handle_udp_message(memoryview(buf)[:nbytes], addr, self.udp_sock)
+      finally:
+        _udp_buffer_pool.append(buf)
+
+
+async def _run_udp(on_ready=None):
   udp_sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+  udp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, UDP_SOCKET_BUFFER_SIZE)
+  udp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, UDP_SOCKET_BUFFER_SIZE)
+  logging.info(
+    f"UDP socket buffers: SO_RCVBUF={udp_sock.getsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF)}, "
+    f"SO_SNDBUF={udp_sock.getsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF)} (requested {UDP_SOCKET_BUFFER_SIZE})"
+  )
+  if UDP_WORKER_PROCESSES > 1:
+    udp_sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
   udp_sock.bind((SERVER_ADDRESS, UDP_SERVER_PORT))
+  udp_sock.setblocking(False)
+  loop = asyncio.get_running_loop()
+  # ソケットは自前で保持し、recvfrom_intoでの受信とsendmmsg/sendtoでのリレーに使う
+  reader = _UdpReader(udp_sock)
+  loop.add_reader(udp_sock.fileno(), reader.on_readable)
   logging.info(f"UDP server listening on {SERVER_ADDRESS}: {UDP_SERVER_PORT}")
-  while True:
-    try:
-      data, addr = udp_sock.recvfrom(65535)
-      threading.Thread(target=handle_udp_message, args=(data, addr, udp_sock), daemon=True).start()
-    except Exception as e:
-      logging.exception(f"UDP server error")
+  if on_ready is not None:
+    on_ready()
+  try:
+    await asyncio.Event().wait()
+  finally:
+    loop.remove_reader(udp_sock.fileno())
+    udp_sock.close()
+    
+    
+def udp_server(on_ready=None):
+  """
+  UDPサーバーを起動し、チャットメッセージの受信とリレーを行います。
+  on_readyを渡すと、ソケットのbindが完了した時点で呼び出します。
+  受信とリレーは単一スレッドのasyncioイベントループ上で行います。
+  ソケットの読み込み可能通知(add_reader)を使うため、Windowsの既定である
+  ProactorEventLoopではなくSelectorEventLoopを明示的に使います。
+  """
+  loop = asyncio.SelectorEventLoop()
+  try:
+    loop.run_until_complete(_run_udp(on_ready))
+  finally:
+    loop.close()
+      
+      
+def _exit_with_parent():
+  """
+  子プロセス(UDPワーカー、Manager)の起動時に呼び出します。
+  親プロセスがSIGKILLなどで後始末せずに終了した場合もSIGTERMで終了するようにし、
+  古いルーム情報を持ったワーカーがSO_REUSEPORTのポートに残らないようにします。
+  """
+  # 親プロセスのSIGTERMハンドラを引き継がず、terminate()ですぐ終了させる
+  signal.signal(signal.SIGTERM, signal.SIG_DFL)
+  if _libc_prctl is not None:
+    _libc_prctl(PR_SET_PDEATHSIG, signal.SIGTERM, 0, 0, 0)
+    # 設定する前に親プロセスがすでに終了していた場合
+    if os.getppid() != multiprocessing.parent_process().pid:
+      os._exit(1)
+      
+      
+def _handle_sigterm(signum, frame):
+  # SystemExitで終了させ、multiprocessingの終了処理でUDPワーカーとManagerを終了させる
+  logging.info(f"Received SIGTERM. Server shutting down.")
+  raise SystemExit(0)
+      
+      
+def udp_worker(chat_rooms, version, started):
+  """
+  UDPワーカープロセスのエントリポイントです。
+  共有辞書を参照するChatRoomManagerを生成し、UDPサーバーを起動します。
+  bindに成功したかどうかをstarted(multiprocessing.Queue)で親プロセスに知らせます。
+  """
+  global chat_room_manager
+  _exit_with_parent()
+  chat_room_manager = ChatRoomManager(chat_rooms, version)
+  ready = False
+  def on_ready():
+    nonlocal ready
+    ready = True
+    started.put(True)
+  try:
+    udp_server(on_ready)
+  except KeyboardInterrupt:
+    pass
+  except Exception:
+    logging.exception(f"UDP worker {os.getpid()} failed")
+    if not ready:
+      started.put(False)
       
       
 if __name__ == "__main__":
-  chat_room_manager = ChatRoomManager()
-  # TCPサーバーとUDPサーバーを別スレッドで起動
+  # kill/systemd/docker stopのSIGTERMでもCtrl+Cと同様に子プロセスを終了させてから終了する
+  signal.signal(signal.SIGTERM, _handle_sigterm)
+  if UDP_WORKER_PROCESSES > 1:
+    # チャットルームの状態はManagerの共有辞書に置き、UDPワーカープロセスから参照する
+    # スレッドを起動する前にワーカープロセスを生成する
+    room_store = SyncManager()
+    room_store.start(_exit_with_parent)
+    chat_room_manager = ChatRoomManager(room_store.dict(), multiprocessing.RawValue("Q", 0))
+    started = multiprocessing.Queue()
+    udp_workers = [
+      multiprocessing.Process(
+        target=udp_worker, args=(chat_room_manager.chat_rooms, chat_room_manager.version, started), daemon=True
+      )
+      for _ in range(UDP_WORKER_PROCESSES)
+    ]
+    for worker in udp_workers:
+      worker.start()
+    # 1つでもbindに失敗したワーカーがあれば、UDPなしでTCPだけ動かし続けないように終了する
+    try:
+      ok = all(started.get(timeout=UDP_WORKER_START_TIMEOUT) for _ in udp_workers)
+    except queue.Empty:
+      ok = False
+    if not ok:
+      logging.error(f"Failed to start UDP worker processes. Server shutting down.")
+      for worker in udp_workers:
+        worker.terminate()
+      raise SystemExit(1)
+    logging.info(f"Started {UDP_WORKER_PROCESSES} UDP worker processes")
+  else:
+    chat_room_manager = ChatRoomManager()
+    udp_started = threading.Event()
+    udp_thread = threading.Thread(target=udp_server, args=(udp_started.set,), daemon=True)
+    udp_thread.start()
+    # bindに失敗するとスレッドが終了するので、その場合はTCPだけ動かし続けないように終了する
+    while udp_thread.is_alive() and not udp_started.wait(0.1):
+      pass
+    if not udp_started.is_set():
+      logging.error(f"Failed to start UDP server. Server shutting down.")
+      raise SystemExit(1)
+    udp_workers = [udp_thread]
+  # TCPサーバーは別スレッドで起動
   tcp_thread = threading.Thread(target=tcp_server, daemon=True)
-  udp_thread = threading.Thread(target=udp_server, daemon=True)
   tcp_thread.start()
-  udp_thread.start()
   logging.info(f"Server started. Press Ctrl+C to exit.")
   try:
     while True:
       threading.Event().wait(1)
+      if any(not worker.is_alive() for worker in udp_workers):
+        logging.error(f"UDP server exited unexpectedly. Server shutting down.")
+        raise SystemExit(1)
+      if not tcp_thread.is_alive():
+        logging.error(f"TCP server exited unexpectedly. Server shutting down.")
+        raise SystemExit(1)
   except KeyboardInterrupt:
     logging.info(f"Server shutting down.")